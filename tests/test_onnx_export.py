@@ -0,0 +1,41 @@
+import pytest
+import torch
+from allennlp.data import Vocabulary
+from transformers import BertConfig, BertModel
+
+from transformer_srl.models import TransformerSrlDependency, _run_onnx_encoder
+from transformer_srl.predictors import SrlTransformersPredictor
+
+onnxruntime = pytest.importorskip("onnxruntime")
+
+
+def test_export_onnx_matches_encode(tmp_path):
+    config = BertConfig(
+        vocab_size=100,
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=64,
+    )
+    vocab = Vocabulary()
+    vocab.add_tokens_to_namespace(["O", "B-ARG0", "B-V"], "labels")
+    vocab.add_tokens_to_namespace(["run.01", "walk.01"], "frames_labels")
+    model = TransformerSrlDependency(vocab, BertModel(config)).eval()
+    # the predictor constructor loads spaCy, which the export does not need
+    predictor = object.__new__(SrlTransformersPredictor)
+    predictor._model = model
+
+    predictor.export_onnx(str(tmp_path / "encoder.onnx"), optimize=False)
+
+    # a different shape than the export dummy input, to check the dynamic axes
+    input_ids = torch.randint(1, config.vocab_size, (3, 7))
+    token_type_ids = torch.zeros_like(input_ids)
+    token_type_ids[:, 2] = 1
+    attention_mask = torch.ones_like(input_ids, dtype=torch.bool)
+    attention_mask[0, 5:] = False
+    with torch.no_grad():
+        expected = model._encode(input_ids, token_type_ids, attention_mask)
+    actual = _run_onnx_encoder(model._onnx_session, input_ids, token_type_ids, attention_mask)
+    assert actual.shape == expected.shape
+    assert torch.allclose(actual, expected, atol=1e-4)
@@ -1,12 +1,20 @@
+import hashlib
 import pathlib
-from typing import Any, Dict, List, Union
+from itertools import chain
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import torch
 import torch.nn.functional as F
 from allennlp.data import TextFieldTensors, Vocabulary
 from allennlp.models.model import Model
 from allennlp.nn import InitializerApplicator, util
-from allennlp.nn.util import get_text_field_mask, sequence_cross_entropy_with_logits
+from allennlp.nn.util import (
+    get_lengths_from_binary_sequence_mask,
+    get_text_field_mask,
+    sequence_cross_entropy_with_logits,
+    viterbi_decode,
+)
 from allennlp.training.metrics.fbeta_measure import FBetaMeasure
 from allennlp_models.structured_prediction import SrlBert
 from allennlp_models.structured_prediction.metrics.srl_eval_scorer import (
@@ -17,12 +25,156 @@ from overrides import overrides
 from torch import nn
 from transformers import AutoModel, AutoConfig
 
-from transformer_srl.utils import load_label_list
+from transformer_srl.utils import load_cache, load_label_list, load_lemma_frame, save_cache
 
 FRAME_LIST_PATH = pathlib.Path(__file__).resolve().parent / "resources" / "framelist.txt"
 ROLE_LIST_PATH = pathlib.Path(__file__).resolve().parent / "resources" / "rolelist.txt"
 
 
+def _build_lemma_frame_ids(
+    frame_tokens: List[str], lemma_frame_path: str = None
+) -> Tuple[Dict[str, int], np.ndarray, np.ndarray]:
+    """
+    Index the vocabulary ids of the frames each lemma can evoke in CSR layout:
+    the candidates of the lemma with index `i` are `frame_ids[frame_ptr[i]:frame_ptr[i + 1]]`.
+    An extra empty row at the end is used for unknown lemmas.
+    The index is cached in a pickle next to `lemma_frame_path`, and reused while it is
+    newer than the file and was built with the same frame vocabulary.
+    Returns the lemma index, the flat frame ids and the row offsets.
+    """
+    if lemma_frame_path is None:
+        return {}, np.empty(0, dtype=np.int64), np.zeros(2, dtype=np.int64)
+    lemma_frame_path = pathlib.Path(lemma_frame_path)
+    cache_path = lemma_frame_path.with_name(lemma_frame_path.name + ".ids.pkl")
+    vocab_hash = hashlib.sha1("\n".join(frame_tokens).encode("utf-8")).hexdigest()
+    cache = load_cache(cache_path, lemma_frame_path)
+    if cache is not None and cache["vocab_hash"] == vocab_hash:
+        return cache["lemma_index"], cache["frame_ids"], cache["frame_ptr"]
+
+    # this index is the only cache, the parsed dictionary is not saved
+    lemma_frame_dict = load_lemma_frame(lemma_frame_path)
+    frame_vocab = {frame: i for i, frame in enumerate(frame_tokens)}
+    lemma_index = {lemma: i for i, lemma in enumerate(lemma_frame_dict)}
+    candidates = [
+        [frame_vocab[f] for f in frames if f in frame_vocab] for frames in lemma_frame_dict.values()
+    ]
+    frame_ptr = np.zeros(len(candidates) + 2, dtype=np.int64)
+    frame_ptr[1:-1] = np.cumsum([len(c) for c in candidates], dtype=np.int64)
+    frame_ptr[-1] = frame_ptr[-2]
+    frame_ids = np.fromiter(chain.from_iterable(candidates), dtype=np.int64)
+    cache = {
+        "vocab_hash": vocab_hash,
+        "lemma_index": lemma_index,
+        "frame_ids": frame_ids,
+        "frame_ptr": frame_ptr,
+    }
+    save_cache(cache, cache_path)
+    return lemma_index, frame_ids, frame_ptr
+
+
+def _frame_candidates_mask(
+    lemmas: List[str],
+    lemma_index: Dict[str, int],
+    frame_ids: np.ndarray,
+    frame_ptr: np.ndarray,
+    num_frames: int,
+    device: torch.device,
+) -> torch.BoolTensor:
+    """
+    Build a `(batch_size, num_frames)` mask of the frames allowed for each lemma.
+    Rows whose lemma has no known candidate allow every frame.
+    """
+    unknown = len(frame_ptr) - 2
+    lemma_ids = np.fromiter(
+        (lemma_index.get(lemma, unknown) for lemma in lemmas), dtype=np.int64, count=len(lemmas)
+    )
+    starts = frame_ptr[lemma_ids]
+    counts = frame_ptr[lemma_ids + 1] - starts
+    # row and position in `frame_ids` of every candidate of the batch
+    rows = np.repeat(np.arange(len(lemmas)), counts)
+    positions = np.arange(counts.sum()) + np.repeat(starts - np.cumsum(counts) + counts, counts)
+    mask = torch.zeros(len(lemmas), num_frames, dtype=torch.bool, device=device)
+    rows = torch.from_numpy(rows).to(device)
+    columns = torch.from_numpy(frame_ids[positions]).to(device)
+    mask[rows, columns] = True
+    return mask | ~mask.any(dim=-1, keepdim=True)
+
+
+def _copy_to_host(tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Start copying a cuda tensor into a new pinned host tensor, without blocking.
+    The copy can be read only after the cuda stream is synchronized.
+    Cpu tensors are returned as they are.
+    """
+    tensor = tensor.detach()
+    if not tensor.is_cuda:
+        return tensor
+    host_tensor = torch.empty(tensor.size(), dtype=tensor.dtype, pin_memory=True)
+    host_tensor.copy_(tensor, non_blocking=True)
+    return host_tensor
+
+
+def _synchronize(device: torch.device) -> None:
+    """
+    Wait for the pending copies of `_copy_to_host` on `device`.
+    """
+    if device.type == "cuda":
+        torch.cuda.current_stream(device).synchronize()
+
+
+def _run_onnx_encoder(
+    session,
+    input_ids: torch.LongTensor,
+    token_type_ids: torch.LongTensor,
+    attention_mask: torch.BoolTensor,
+) -> torch.FloatTensor:
+    """
+    Run the transformer exported by `SrlTransformersPredictor.export_onnx`
+    with ONNX Runtime, in place of `_encode`.
+    """
+    (embeddings,) = session.run(
+        None,
+        {
+            "input_ids": input_ids.cpu().numpy(),
+            "token_type_ids": token_type_ids.long().cpu().numpy(),
+            "attention_mask": attention_mask.long().cpu().numpy(),
+        },
+    )
+    return torch.from_numpy(embeddings).to(input_ids.device)
+
+
+@torch.jit.script
+def _span_epilogue(
+    lstm_output: torch.Tensor,
+    frame_embeddings: torch.Tensor,
+    hidden_weight: torch.Tensor,
+    hidden_bias: torch.Tensor,
+    tag_weight: torch.Tensor,
+    tag_bias: torch.Tensor,
+    frame_weight: torch.Tensor,
+    frame_bias: torch.Tensor,
+    normalize: bool,
+) -> Tuple[torch.Tensor, Optional[torch.Tensor], torch.Tensor, Optional[torch.Tensor]]:
+    """
+    Role and frame heads of `TransformerSrlSpan`, scripted so that the
+    projections and normalizations run without going through python.
+    Returns role logits and log probabilities (for viterbi decoding),
+    frame logits and probabilities. The losses only need the logits, so
+    the normalized scores are `None` unless `normalize` is set.
+    """
+    hidden = F.relu(F.linear(lstm_output, hidden_weight, hidden_bias))
+    logits = F.linear(hidden, tag_weight, tag_bias)
+    frame_logits = F.linear(frame_embeddings, frame_weight, frame_bias)
+    if not normalize:
+        return logits, None, frame_logits, None
+    return (
+        logits,
+        F.log_softmax(logits, dim=-1),
+        frame_logits,
+        F.softmax(frame_logits, dim=-1),
+    )
+
+
 @Model.register("transformer_srl_span")
 class TransformerSrlSpan(SrlBert):
     """
@@ -72,6 +224,26 @@ class TransformerSrlSpan(SrlBert):
             self.vocab.add_tokens_to_namespace(role_list, "labels")
         self.num_classes = self.vocab.get_vocab_size("labels")
         self.frame_num_classes = self.vocab.get_vocab_size("frames_labels")
+        # frame restriction, enabled by the predictor
+        self.restrict_frames = False
+        # mixed precision transformer, enabled by the predictor
+        self.use_amp = False
+        # ONNX Runtime session replacing the transformer, set by the predictor
+        self._onnx_session = None
+        self._idx_to_frame_token = [
+            self.vocab.get_token_from_index(i, namespace="frames_labels")
+            for i in range(self.frame_num_classes)
+        ]
+        self._lemma_index, self._frame_ids, self._frame_ptr = _build_lemma_frame_ids(
+            self._idx_to_frame_token
+        )
+        # the BIO constraints only depend on the label vocabulary, build them once
+        self._idx_to_label_token = [
+            self.vocab.get_token_from_index(i, namespace="labels") for i in range(self.num_classes)
+        ]
+        self._viterbi_transitions = self.get_viterbi_pairwise_potentials()
+        self._start_transitions = self.get_start_transitions()
+        self._outside_index = self.vocab.get_token_index("O", namespace="labels")
         if srl_eval_path is not None:
             # For the span based evaluation, we don't want to consider labels
             # for verb, because the verb index is provided to the model.
@@ -142,62 +314,71 @@ class TransformerSrlSpan(SrlBert):
         logits : `torch.FloatTensor`
             A tensor of shape `(batch_size, num_tokens, tag_vocab_size)` representing
             unnormalised log probabilities of the tag classes.
-        class_probabilities : `torch.FloatTensor`
+        class_log_probabilities : `torch.FloatTensor`
             A tensor of shape `(batch_size, num_tokens, tag_vocab_size)` representing
-            a distribution of the tag classes per word.
+            a log distribution of the tag classes per word. The distribution itself,
+            `class_probabilities`, is added by `make_output_human_readable`.
         loss : `torch.FloatTensor`, optional
             A scalar loss to be optimised.
         """
         mask = get_text_field_mask(tokens)
+        # We add in the offsets here so we can compute the un-wordpieced tags.
+        words, lemmas, verbs, offsets = [], [], [], []
+        for x in metadata:
+            words.append(x["words"])
+            lemmas.extend(x["lemmas"])
+            verbs.append(x["verb"])
+            offsets.append(x["offsets"])
+        metadata_output = {
+            "words": words,
+            "lemma": lemmas,
+            "verb": verbs,
+            "wordpiece_offsets": offsets,
+        }
+        if tags is None and not frame_indicator.any():
+            # there is no predicate to label in the batch, skip the transformer
+            return {**self._empty_output_dict(mask), **metadata_output}
+
         input_ids = util.get_token_ids_from_text_field_tensors(tokens)
         if self.tr_config.type_vocab_size != 1:
             verb_indicator = torch.zeros_like(verb_indicator)
-        embeddings = self.transformer(
-            input_ids=input_ids,
-            token_type_ids=verb_indicator,
-            attention_mask=mask,
-            return_dict=False,
-        )
-        embeddings = embeddings[2][-4:]
-        embeddings = torch.stack(embeddings, dim=0).sum(dim=0)
-        # get sizes
-        batch_size, sequence_length, _ = embeddings.size()
+        if self._onnx_session is not None:
+            embeddings = _run_onnx_encoder(self._onnx_session, input_ids, verb_indicator, mask)
+        else:
+            with torch.cuda.amp.autocast(enabled=self.use_amp):
+                embeddings = self._encode(input_ids, verb_indicator, mask)
         # extract embeddings
         embedded_text_input = self.embedding_dropout(embeddings)
-        frame_embeddings = embedded_text_input[frame_indicator == 1]
-        predicate_embeddings = torch.index_select(embedded_text_input, 1, sentence_end)
-        print(predicate_embeddings.shape)
-        print(embedded_text_input.shape)
-        # embedded_text_input += predicate_embeddings
+        # predicate positions, shared by the frame embeddings and the gold frames
+        verb_positions = (frame_indicator == 1).nonzero(as_tuple=True)
+        frame_embeddings = embedded_text_input[verb_positions]
         # lstm pass
         embedded_text_input = self.lstms(embedded_text_input)[0]
         # outputs
-        logits = self.tag_projection_layer(embedded_text_input)
-        frame_logits = self.frame_projection_layer(frame_embeddings)
-
-        reshaped_log_probs = logits.view(-1, self.num_classes)
-        class_probabilities = F.softmax(reshaped_log_probs, dim=-1).view(
-            [batch_size, sequence_length, self.num_classes]
+        hidden_layer, _, tag_layer = self.tag_projection_layer
+        logits, class_log_probabilities, frame_logits, frame_probabilities = _span_epilogue(
+            embedded_text_input,
+            frame_embeddings,
+            hidden_layer.weight,
+            hidden_layer.bias,
+            tag_layer.weight,
+            tag_layer.bias,
+            self.frame_projection_layer.weight,
+            self.frame_projection_layer.bias,
+            not self.training,
         )
-
-        frame_probabilities = F.softmax(frame_logits, dim=-1)
         # We need to retain the mask in the output dictionary
         # so that we can crop the sequences to remove padding
         # when we do viterbi inference in self.make_output_human_readable.
         output_dict = {
             "logits": logits,
             "frame_logits": frame_logits,
-            "class_probabilities": class_probabilities,
-            "frame_probabilities": frame_probabilities,
             "mask": mask,
+            **metadata_output,
         }
-        # We add in the offsets here so we can compute the un-wordpieced tags.
-        words, verbs, offsets = zip(*[(x["words"], x["verb"], x["offsets"]) for x in metadata])
-        lemmas = [l for x in metadata for l in x["lemmas"]]
-        output_dict["words"] = list(words)
-        output_dict["lemma"] = list(lemmas)
-        output_dict["verb"] = list(verbs)
-        output_dict["wordpiece_offsets"] = list(offsets)
+        if not self.training:
+            output_dict["class_log_probabilities"] = class_log_probabilities
+            output_dict["frame_probabilities"] = frame_probabilities
 
         if tags is not None:
             # compute role loss
@@ -205,15 +386,15 @@ class TransformerSrlSpan(SrlBert):
                 logits, tags, mask, label_smoothing=self._label_smoothing
             )
             # compute frame loss
-            frame_tags_filtered = frame_tags[frame_indicator == 1]
+            frame_tags_filtered = frame_tags[verb_positions]
             frame_loss = self.frame_criterion(frame_logits, frame_tags_filtered)
             if not self.ignore_span_metric and self.span_metric is not None and not self.training:
                 batch_verb_indices = [
                     example_metadata["verb_index"] for example_metadata in metadata
                 ]
                 batch_sentences = [example_metadata["words"] for example_metadata in metadata]
-                # Get the BIO tags from make_output_human_readable()
-                batch_bio_predicted_tags = self.make_output_human_readable(output_dict).pop("tags")
+                # Get the BIO tags, frames are not needed for the span metric
+                batch_bio_predicted_tags = self._decode_tags(output_dict).pop("tags")
                 from allennlp_models.structured_prediction.models.srl import (
                     convert_bio_tags_to_conll_format,
                 )
@@ -239,16 +420,74 @@ class TransformerSrlSpan(SrlBert):
             output_dict["loss"] = (role_loss + frame_loss) / 2
         return output_dict
 
+    def _encode(
+        self,
+        input_ids: torch.LongTensor,
+        token_type_ids: torch.LongTensor,
+        attention_mask: torch.BoolTensor,
+    ) -> torch.FloatTensor:
+        # sum of the last four hidden states
+        hidden_states = self.transformer(
+            input_ids=input_ids,
+            token_type_ids=token_type_ids,
+            attention_mask=attention_mask,
+            return_dict=False,
+        )[2][-4:]
+        # the heads always run in fp32
+        return torch.stack(hidden_states, dim=0).float().sum(dim=0)
+
+    def _empty_output_dict(self, mask: torch.BoolTensor) -> Dict[str, torch.Tensor]:
+        # outputs of a batch without predicates: every token is tagged as outside
+        batch_size, sequence_length = mask.size()
+        logits = mask.new_zeros((batch_size, sequence_length, self.num_classes), dtype=torch.float)
+        class_log_probabilities = torch.full_like(logits, float("-inf"))
+        class_log_probabilities[..., self._outside_index] = 0.0
+        frame_logits = logits.new_zeros((0, self.frame_num_classes))
+        return {
+            "logits": logits,
+            "frame_logits": frame_logits,
+            "class_log_probabilities": class_log_probabilities,
+            "frame_probabilities": frame_logits,
+            "mask": mask,
+        }
+
+    def load_lemma_frame_index(self, lemma_frame_path: str) -> None:
+        """
+        Load the frames each lemma can evoke from a file in the format `lemma frame1 frame2 ...`.
+        They restrict the predicted frames when `restrict_frames` is set.
+        """
+        self._lemma_index, self._frame_ids, self._frame_ptr = _build_lemma_frame_ids(
+            self._idx_to_frame_token, lemma_frame_path
+        )
+
     def decode_frames(self, output_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         # frame prediction
         frame_probabilities = output_dict["frame_probabilities"]
-        frame_predictions = frame_probabilities.argmax(dim=-1).cpu().data.numpy()
+        if frame_probabilities.size(0) == 0:
+            # batch without predicates, see `_empty_output_dict`
+            output_dict["frame_tags"] = []
+            output_dict["frame_scores"] = []
+            return output_dict
+        if self.restrict_frames and self._lemma_index:
+            mask = _frame_candidates_mask(
+                output_dict["lemma"],
+                self._lemma_index,
+                self._frame_ids,
+                self._frame_ptr,
+                self.frame_num_classes,
+                frame_probabilities.device,
+            )
+            frame_probabilities = frame_probabilities.masked_fill(~mask, float("-inf"))
+        # only the (batch_size,) predictions and scores are moved to the cpu,
+        # with a single synchronization for both copies
+        frame_scores, frame_predictions = frame_probabilities.max(dim=-1)
+        frame_scores = _copy_to_host(frame_scores)
+        frame_predictions = _copy_to_host(frame_predictions)
+        _synchronize(frame_probabilities.device)
         output_dict["frame_tags"] = [
-            self.vocab.get_token_from_index(f, namespace="frames_labels") for f in frame_predictions
-        ]
-        output_dict["frame_scores"] = [
-            fp[f] for f, fp in zip(frame_predictions, frame_probabilities)
+            self._idx_to_frame_token[f] for f in frame_predictions.tolist()
         ]
+        output_dict["frame_scores"] = frame_scores.tolist()
         return output_dict
 
     @overrides
@@ -256,7 +495,32 @@ class TransformerSrlSpan(SrlBert):
         self, output_dict: Dict[str, torch.Tensor]
     ) -> Dict[str, torch.Tensor]:
         output_dict = self.decode_frames(output_dict)
-        output_dict = super().make_output_human_readable(output_dict)
+        output_dict = self._decode_tags(output_dict)
+        # forward only computes log probabilities, keep the probabilities
+        # in the human readable output for external consumers
+        output_dict["class_probabilities"] = output_dict["class_log_probabilities"].exp()
+        return output_dict
+
+    def _decode_tags(self, output_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        # viterbi decoding of the BIO role tags
+        # move the whole batch to the cpu at once, instead of one copy per sentence
+        all_predictions = output_dict["class_log_probabilities"].detach().cpu()
+        sequence_lengths = get_lengths_from_binary_sequence_mask(output_dict["mask"]).tolist()
+        wordpiece_tags = []
+        word_tags = []
+        for predictions, length, offsets in zip(
+            all_predictions, sequence_lengths, output_dict["wordpiece_offsets"]
+        ):
+            max_likelihood_sequence, _ = viterbi_decode(
+                predictions[:length],
+                self._viterbi_transitions,
+                allowed_start_transitions=self._start_transitions,
+            )
+            tags = [self._idx_to_label_token[x] for x in max_likelihood_sequence]
+            wordpiece_tags.append(tags)
+            word_tags.append([tags[i] for i in offsets])
+        output_dict["wordpiece_tags"] = wordpiece_tags
+        output_dict["tags"] = word_tags
         return output_dict
 
     @overrides
@@ -330,6 +594,20 @@ class TransformerSrlDependency(Model):
         # number of classes
         self.num_classes = self.vocab.get_vocab_size("labels")
         self.frame_num_classes = self.vocab.get_vocab_size("frames_labels")
+        # frame restriction, enabled by the predictor
+        self.restrict_frames = False
+        # mixed precision transformer, enabled by the predictor
+        self.use_amp = False
+        # ONNX Runtime session replacing the transformer, set by the predictor
+        self._onnx_session = None
+        self._idx_to_frame_token = [
+            self.vocab.get_token_from_index(i, namespace="frames_labels")
+            for i in range(self.frame_num_classes)
+        ]
+        self._lemma_index, self._frame_ids, self._frame_ptr = _build_lemma_frame_ids(
+            self._idx_to_frame_token
+        )
+        self._outside_index = self.vocab.get_token_index("O", namespace="labels")
         # metrics
         role_set = self.vocab.get_token_to_index_vocabulary("labels")
         role_set_filter = [v for k, v in role_set.items() if k != "O"]
@@ -389,43 +667,46 @@ class TransformerSrlDependency(Model):
             A scalar loss to be optimised.
         """
         mask = get_text_field_mask(tokens)
-        bert_embeddings, _ = self.transformer(
-            input_ids=util.get_token_ids_from_text_field_tensors(tokens),
-            token_type_ids=verb_indicator,
-            attention_mask=mask,
-            return_dict=False,
-        )
+        words, verbs, lemmas = [], [], []
+        for x in metadata:
+            words.append(x["words"])
+            verbs.append(x["verb"])
+            lemmas.extend(x["lemmas"])
+        metadata_output = {"words": words, "verb": verbs, "lemma": lemmas}
+        if tags is None and not frame_indicator.any():
+            # there is no predicate to label in the batch, skip the transformer
+            return {**self._empty_output_dict(mask), **metadata_output}
+
+        input_ids = util.get_token_ids_from_text_field_tensors(tokens)
+        if self._onnx_session is not None:
+            bert_embeddings = _run_onnx_encoder(
+                self._onnx_session, input_ids, verb_indicator, mask
+            )
+        else:
+            with torch.cuda.amp.autocast(enabled=self.use_amp):
+                bert_embeddings = self._encode(input_ids, verb_indicator, mask)
 
         # extract embeddings
         embedded_text_input = self.embedding_dropout(bert_embeddings)
-        frame_embeddings = embedded_text_input[frame_indicator == 1]
-        # get sizes
-        batch_size, sequence_length, _ = embedded_text_input.size()
+        # predicate positions, shared by the frame embeddings and the gold frames
+        verb_positions = (frame_indicator == 1).nonzero(as_tuple=True)
+        frame_embeddings = embedded_text_input[verb_positions]
         # outputs
         logits = self.tag_projection_layer(embedded_text_input)
         frame_logits = self.frame_projection_layer(frame_embeddings)
-
-        reshaped_log_probs = logits.view(-1, self.num_classes)
-        role_probabilities = F.softmax(reshaped_log_probs, dim=-1).view(
-            [batch_size, sequence_length, self.num_classes]
-        )
-        frame_probabilities = F.softmax(frame_logits, dim=-1)
         # We need to retain the mask in the output dictionary
         # so that we can crop the sequences to remove padding
         # when we do viterbi inference in self.make_output_human_readable.
         output_dict = {
             "logits": logits,
             "frame_logits": frame_logits,
-            "role_probabilities": role_probabilities,
-            "frame_probabilities": frame_probabilities,
             "mask": mask,
+            **metadata_output,
         }
-        # We add in the offsets here so we can compute the un-wordpieced tags.
-        words, verbs = zip(*[(x["words"], x["verb"]) for x in metadata])
-        lemmas = [l for x in metadata for l in x["lemmas"]]
-        output_dict["words"] = list(words)
-        output_dict["verb"] = list(verbs)
-        output_dict["lemma"] = list(lemmas)
+        # the losses and metrics only need the logits
+        if not self.training:
+            output_dict["role_probabilities"] = F.softmax(logits, dim=-1)
+            output_dict["frame_probabilities"] = F.softmax(frame_logits, dim=-1)
 
         if tags is not None:
             # compute role loss
@@ -434,10 +715,10 @@ class TransformerSrlDependency(Model):
             # )
             role_loss = self.role_criterion(logits.view(-1, self.num_classes), tags.view(-1))
             # compute frame loss
-            frame_tags_filtered = frame_tags[frame_indicator == 1]
+            frame_tags_filtered = frame_tags[verb_positions]
             frame_loss = self.frame_criterion(frame_logits, frame_tags_filtered)
 
-            self.f1_role_metric(role_probabilities, tags)
+            self.f1_role_metric(logits, tags)
             self.f1_frame_metric(frame_logits, frame_tags_filtered)
 
             output_dict["frame_loss"] = frame_loss
@@ -445,16 +726,74 @@ class TransformerSrlDependency(Model):
             output_dict["loss"] = (role_loss + frame_loss) / 2
         return output_dict
 
+    def _encode(
+        self,
+        input_ids: torch.LongTensor,
+        token_type_ids: torch.LongTensor,
+        attention_mask: torch.BoolTensor,
+    ) -> torch.FloatTensor:
+        # last hidden state
+        hidden_states = self.transformer(
+            input_ids=input_ids,
+            token_type_ids=token_type_ids,
+            attention_mask=attention_mask,
+            return_dict=False,
+        )[0]
+        # the heads always run in fp32
+        return hidden_states.float()
+
+    def _empty_output_dict(self, mask: torch.BoolTensor) -> Dict[str, torch.Tensor]:
+        # outputs of a batch without predicates: every token is tagged as outside
+        batch_size, sequence_length = mask.size()
+        logits = mask.new_zeros((batch_size, sequence_length, self.num_classes), dtype=torch.float)
+        role_probabilities = torch.zeros_like(logits)
+        role_probabilities[..., self._outside_index] = 1.0
+        frame_logits = logits.new_zeros((0, self.frame_num_classes))
+        return {
+            "logits": logits,
+            "frame_logits": frame_logits,
+            "role_probabilities": role_probabilities,
+            "frame_probabilities": frame_logits,
+            "mask": mask,
+        }
+
+    def load_lemma_frame_index(self, lemma_frame_path: str) -> None:
+        """
+        Load the frames each lemma can evoke from a file in the format `lemma frame1 frame2 ...`.
+        They restrict the predicted frames when `restrict_frames` is set.
+        """
+        self._lemma_index, self._frame_ids, self._frame_ptr = _build_lemma_frame_ids(
+            self._idx_to_frame_token, lemma_frame_path
+        )
+
     def decode_frames(self, output_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         # frame prediction
         frame_probabilities = output_dict["frame_probabilities"]
-        frame_predictions = frame_probabilities.argmax(dim=-1).cpu().data.numpy()
+        if frame_probabilities.size(0) == 0:
+            # batch without predicates, see `_empty_output_dict`
+            output_dict["frame_tags"] = []
+            output_dict["frame_scores"] = []
+            return output_dict
+        if self.restrict_frames and self._lemma_index:
+            mask = _frame_candidates_mask(
+                output_dict["lemma"],
+                self._lemma_index,
+                self._frame_ids,
+                self._frame_ptr,
+                self.frame_num_classes,
+                frame_probabilities.device,
+            )
+            frame_probabilities = frame_probabilities.masked_fill(~mask, float("-inf"))
+        # only the (batch_size,) predictions and scores are moved to the cpu,
+        # with a single synchronization for both copies
+        frame_scores, frame_predictions = frame_probabilities.max(dim=-1)
+        frame_scores = _copy_to_host(frame_scores)
+        frame_predictions = _copy_to_host(frame_predictions)
+        _synchronize(frame_probabilities.device)
         output_dict["frame_tags"] = [
-            self.vocab.get_token_from_index(f, namespace="frames_labels") for f in frame_predictions
-        ]
-        output_dict["frame_scores"] = [
-            fp[f] for f, fp in zip(frame_predictions, frame_probabilities)
+            self._idx_to_frame_token[f] for f in frame_predictions.tolist()
         ]
+        output_dict["frame_scores"] = frame_scores.tolist()
         return output_dict
 
     @overrides
@@ -1,10 +1,14 @@
 import enum
+import logging
+from itertools import accumulate, groupby
+from operator import itemgetter
 from typing import List, Dict, Type
 from allennlp.data.tokenizers.token_class import Token
 
 import numpy
+import torch
 from allennlp.common import plugins
-from allennlp.common.util import JsonDict, sanitize, group_by_count
+from allennlp.common.util import JsonDict, sanitize
 from allennlp.data import DatasetReader, Instance
 from allennlp.models import Model
 from allennlp.models.archival import Archive, load_archive
@@ -13,6 +17,22 @@ from allennlp_models.structured_prediction import SemanticRoleLabelerPredictor
 from overrides import overrides
 from spacy.tokens import Doc
 
+logger = logging.getLogger(__name__)
+
+
+class _TransformerEncoder(torch.nn.Module):
+    """
+    Exposes the transformer part of a model, as computed by its `_encode` method,
+    so that it can be exported to ONNX on its own.
+    """
+
+    def __init__(self, model: Model) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, token_type_ids, attention_mask):
+        return self.model._encode(input_ids, token_type_ids, attention_mask)
+
 
 @Predictor.register("transformer_srl")
 class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
@@ -26,12 +46,32 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
 
     @staticmethod
     def make_srl_string(words: List[str], tags: List[str], frame: str) -> str:
-        srl_string = SemanticRoleLabelerPredictor.make_srl_string(words, tags)
-        srl_string = srl_string.replace("[V", "[" + frame)
-        return srl_string
+        description = []
+        # every tag that is not a continuation starts a new chunk
+        chunk_ids = accumulate(tag[:2] != "I-" for tag in tags)
+        for _, chunk in groupby(zip(chunk_ids, tags, words), key=itemgetter(0)):
+            _, chunk_tags, chunk_words = zip(*chunk)
+            head = chunk_tags[0]
+            if head[:2] == "B-":
+                # only the predicate chunk is renamed, other roles starting
+                # with "V" (e.g. Value) and words are left as they are
+                label = frame if head == "B-V" else head[2:]
+                description.append("[" + label + ": " + " ".join(chunk_words) + "]")
+                continue
+            if head == "O":
+                description.append(chunk_words[0])
+            if head[:2] != "I-":
+                chunk_words = chunk_words[1:]
+            # continuations without a beginning are kept as unlabeled chunks
+            if chunk_words:
+                description.append("[" + " ".join(chunk_words) + "]")
+        return " ".join(description)
 
     @overrides
     def _sentence_to_srl_instances(self, json_dict: JsonDict) -> List[Instance]:
+        return self.tokens_to_instances(self._sentence_to_tokens(json_dict))
+
+    def _sentence_to_tokens(self, json_dict: JsonDict) -> List[Token]:
         sentence = json_dict["sentence"]
         if "verbs" in json_dict.keys():
             text = sentence.split()
@@ -39,7 +79,7 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
             tokens = [Token(t, i, i + len(text), pos_=p) for i, (t, p) in enumerate(zip(text, pos))]
         else:
             tokens = self._tokenizer.tokenize(sentence)
-        return self.tokens_to_instances(tokens)
+        return tokens
 
     @overrides
     def tokens_to_instances(self, tokens):
@@ -62,7 +102,11 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
         # that here by taking the batch size which we use to be the number of sentences
         # we are given.
         batch_size = len(inputs)
-        instances_per_sentence = [self._sentence_to_srl_instances(json) for json in inputs]
+        # Keep the tokens, sentences with no verbs are returned as they are
+        tokens_per_sentence = [self._sentence_to_tokens(json) for json in inputs]
+        instances_per_sentence = [
+            self.tokens_to_instances(tokens) for tokens in tokens_per_sentence
+        ]
 
         flattened_instances = [
             instance
@@ -71,21 +115,39 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
         ]
 
         if not flattened_instances:
-            return sanitize(
-                [{"verbs": [], "words": self._tokenizer.tokenize(x["sentence"])} for x in inputs]
-            )
+            return sanitize([{"verbs": [], "words": tokens} for tokens in tokens_per_sentence])
 
-        # Make the instances into batches and check the last batch for
-        # padded elements as the number of instances might not be perfectly
-        # divisible by the batch size.
-        batched_instances = group_by_count(flattened_instances, batch_size, None)
-        batched_instances[-1] = [
-            instance for instance in batched_instances[-1] if instance is not None
-        ]
-        # Run the model on the batches.
-        outputs: List[Dict[str, numpy.ndarray]] = []
-        for batch in batched_instances:
-            outputs.extend(self._model.forward_on_instances(batch))
+        # Sort the sentences by length before making the batches, so that each
+        # batch is padded only to its own longest sentence. Batches are made of whole
+        # sentences, so that the instances of a sentence (one per predicate) always
+        # run in the same forward pass. A sentence with more predicates than the
+        # batch size gets a batch of its own.
+        sentence_lengths = []
+        sentence_starts = [0]
+        for sentence_instances in instances_per_sentence:
+            lengths = [len(instance.fields["tokens"].tokens) for instance in sentence_instances]
+            sentence_lengths.append(max(lengths, default=0))
+            sentence_starts.append(sentence_starts[-1] + len(sentence_instances))
+        batches: List[List[int]] = [[]]
+        for sentence_index in sorted(range(len(inputs)), key=sentence_lengths.__getitem__):
+            sentence_instances = range(
+                sentence_starts[sentence_index], sentence_starts[sentence_index + 1]
+            )
+            if not sentence_instances:
+                continue
+            if batches[-1] and len(batches[-1]) + len(sentence_instances) > batch_size:
+                batches.append([])
+            batches[-1].extend(sentence_instances)
+        # Run the model on the batches, putting the outputs back in the original order.
+        # The span model LSTM is not batch first, so it runs along the batch axis and
+        # its role predictions depend on the instances in the batch and their order:
+        # keep the input order inside each batch.
+        outputs: List[Dict[str, numpy.ndarray]] = [None] * len(flattened_instances)
+        for batch_indices in batches:
+            batch_indices.sort()
+            batch = [flattened_instances[i] for i in batch_indices]
+            for i, output in zip(batch_indices, self._model.forward_on_instances(batch)):
+                outputs[i] = output
 
         verbs_per_sentence = [len(sent) for sent in instances_per_sentence]
         return_dicts: List[JsonDict] = [{"verbs": []} for x in inputs]
@@ -94,10 +156,8 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
         for sentence_index, verb_count in enumerate(verbs_per_sentence):
             if verb_count == 0:
                 # We didn't run any predictions for sentences with no verbs,
-                # so we don't have a way to extract the original sentence.
-                # Here we just tokenize the input again.
-                original_text = self._tokenizer.tokenize(inputs[sentence_index]["sentence"])
-                return_dicts[sentence_index]["words"] = original_text
+                # so we return the tokens of the original sentence.
+                return_dicts[sentence_index]["words"] = tokens_per_sentence[sentence_index]
                 continue
 
             for _ in range(verb_count):
@@ -140,6 +200,57 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
 
         return sanitize(results)
 
+    def export_onnx(self, path: str, opset_version: int = 12, optimize: bool = True) -> None:
+        """
+        Export the transformer encoder of the model to ONNX and run it with ONNX Runtime
+        from now on. Requires the `onnxruntime` package.
+
+        # Parameters
+
+        path : `str`
+            Where to save the ONNX model.
+        opset_version : `int`, optional (default = `12`)
+            The ONNX opset to export with.
+        optimize : `bool`, optional (default = `True`)
+            Apply the ONNX Runtime transformer optimizations (attention, embedding and
+            layer normalization fusions) to the exported model.
+        """
+        import onnxruntime
+
+        config = self._model.transformer.config
+        device = self._model._get_prediction_device()
+        device = torch.device("cpu" if device < 0 else device)
+        dummy_input = torch.ones(2, 16, dtype=torch.long, device=device)
+        dynamic_axes = {0: "batch_size", 1: "sequence_length"}
+        with torch.no_grad():
+            torch.onnx.export(
+                _TransformerEncoder(self._model).eval(),
+                (dummy_input, torch.zeros_like(dummy_input), dummy_input),
+                path,
+                input_names=["input_ids", "token_type_ids", "attention_mask"],
+                output_names=["embeddings"],
+                dynamic_axes={
+                    "input_ids": dynamic_axes,
+                    "token_type_ids": dynamic_axes,
+                    "attention_mask": dynamic_axes,
+                    "embeddings": dynamic_axes,
+                },
+                opset_version=opset_version,
+            )
+        if optimize:
+            from onnxruntime.transformers import optimizer
+
+            optimized_model = optimizer.optimize_model(
+                path,
+                model_type="bert",
+                num_heads=config.num_attention_heads,
+                hidden_size=config.hidden_size,
+            )
+            optimized_model.save_model_to_file(path)
+        self._model._onnx_session = onnxruntime.InferenceSession(
+            path, providers=onnxruntime.get_available_providers()
+        )
+
     @classmethod
     def from_path(
         cls,
@@ -152,6 +263,8 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
         language: str = "en_core_web_sm",
         restrict_frames: bool = False,
         restrict_roles: bool = False,
+        lemma_frame_path: str = None,
+        fp16: bool = False,
     ) -> "Predictor":
         if import_plugins:
             plugins.import_plugins()
@@ -163,6 +276,8 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
             language=language,
             restrict_frames=restrict_frames,
             restrict_roles=restrict_roles,
+            lemma_frame_path=lemma_frame_path,
+            fp16=fp16,
         )
 
     @classmethod
@@ -175,6 +290,8 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
         language: str = "en_core_web_sm",
         restrict_frames: bool = False,
         restrict_roles: bool = False,
+        lemma_frame_path: str = None,
+        fp16: bool = False,
     ) -> "Predictor":
         # Duplicate the config so that the config inside the archive doesn't get consumed
         config = archive.config.duplicate()
@@ -197,6 +314,15 @@ class SrlTransformersPredictor(SemanticRoleLabelerPredictor):
         if frozen:
             model.restrict_frames = restrict_frames
             model.restrict_roles = restrict_roles
+            if lemma_frame_path is not None:
+                model.load_lemma_frame_index(lemma_frame_path)
+            elif restrict_frames:
+                logger.warning(
+                    "restrict_frames is set but no lemma_frame_path was given, "
+                    "frames will not be restricted."
+                )
+            # autocast is a no-op on cpu
+            model.use_amp = fp16 and model._get_prediction_device() >= 0
             model.eval()
 
         return predictor_class(model, dataset_reader, language)
@@ -1,6 +1,12 @@
 from collections import defaultdict
+import os
 import pathlib
-from typing import Dict
+import pickle
+import tempfile
+from typing import Any, Dict
+
+# fixed, so that caches stay readable across the supported python versions
+_CACHE_PICKLE_PROTOCOL = 4
 
 
 def load_role_frame(filename: pathlib.Path) -> Dict:
@@ -17,20 +23,73 @@ def load_role_frame(filename: pathlib.Path) -> Dict:
     return dictionary
 
 
-def load_lemma_frame(filename: pathlib.Path) -> Dict:
+def load_lemma_frame(filename: pathlib.Path, cache: bool = False) -> Dict:
     """
     Open a dictionary from file, in the format lemma -> [frames]
     :param filename: file to read.
+    :param cache: if True, the parsed dictionary is cached in a pickle next to the file,
+        and reused while it is newer than the file.
     :return: a dictionary.
     """
-    dictionary = defaultdict(list)
+    filename = pathlib.Path(filename)
+    cache_filename = filename.with_name(filename.name + ".pkl")
+    if cache:
+        dictionary = load_cache(cache_filename, filename)
+        if dictionary is not None:
+            return dictionary
+    dictionary = {}
     with open(filename) as file:
-        for l in file:
-            k, *v = l.split()
-            dictionary[k] += v
+        for k, *v in (l.split() for l in file.read().splitlines() if l.strip()):
+            dictionary.setdefault(k, []).extend(v)
+    if cache:
+        save_cache(dictionary, cache_filename)
     return dictionary
 
 
+def load_cache(cache_filename: pathlib.Path, filename: pathlib.Path) -> Any:
+    """
+    Load a pickle cache built from a file, if it is newer than the file.
+    :param cache_filename: pickle to read.
+    :param filename: file the cache was built from.
+    :return: the cached object, or None if the cache is missing, stale or unreadable.
+    """
+    try:
+        if cache_filename.stat().st_mtime < filename.stat().st_mtime:
+            return None
+        with open(cache_filename, "rb") as file:
+            return pickle.load(file)
+    except Exception:
+        # truncated, corrupted or written by an incompatible version
+        return None
+
+
+def save_cache(obj: Any, cache_filename: pathlib.Path) -> None:
+    """
+    Save a pickle cache atomically, so that concurrent readers never see a partial file.
+    Nothing is saved if the location is not writable.
+    :param obj: object to save.
+    :param cache_filename: pickle to write.
+    """
+    try:
+        file_descriptor, temp_filename = tempfile.mkstemp(
+            dir=cache_filename.parent, prefix=cache_filename.name
+        )
+    except OSError:
+        # read-only location, the cache is built again next time
+        return
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            pickle.dump(obj, file, protocol=_CACHE_PICKLE_PROTOCOL)
+        os.replace(temp_filename, cache_filename)
+    except OSError:
+        # e.g. disk full, the cache is built again next time
+        pass
+    finally:
+        # left behind only if the cache was not moved into place
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
 def load_label_list(filename: pathlib.Path):
     """
     Load label list from file